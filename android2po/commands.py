@@ -1,18 +1,27 @@
 from __future__ import absolute_import
 
 import os
-import collections
+import pickle
+import threading
+from concurrent import futures
+from hashlib import md5
 try:
     from cStringIO import StringIO as BytesIO
 except ImportError:  # pragma: no cover
     from io import BytesIO
 from io import open
+try:
+    from collections import OrderedDict
+except ImportError:  # pragma: no cover
+    from ordereddict import OrderedDict
 from lxml import etree
+import babel
 from babel.messages import pofile, Catalog
 from termcolor import colored
 
 from . import convert
 from .env import resolve_locale
+from .utils import make_hasher
 
 
 __all__ = ('CommandError', 'ExportCommand', 'ImportCommand', 'InitCommand',)
@@ -22,28 +31,96 @@ class CommandError(Exception):
     pass
 
 
-def read_catalog(filename, **kwargs):
+# Buffer size for reading and writing catalog/resource files. The
+# default 8 KB means babel's line-by-line .po scanner pays the buffer
+# refill cost rather often; 64 KB covers most files in one go.
+FILE_BUFFER_SIZE = 1 << 16
+
+
+def read_catalog(filename, cache_dir=None, **kwargs):
     """Helper to read a catalog from a .po file.
+
+    If ``cache_dir`` is given, the parsed catalog is additionally
+    cached there, keyed on the source file's stat data. babel's .po
+    parser is pure Python and easily the most expensive part of
+    reading a catalog; unpickling a previously parsed one is much
+    cheaper, so repeated runs over unchanged files skip the parse.
     """
-    f = open(filename, 'r', encoding='utf-8')
+    if cache_dir is None:
+        return _parse_catalog(filename, **kwargs)
+
+    st = os.stat(filename)
+    # The babel version is part of the key: the pickled objects are
+    # babel's, so a cache written by a different babel must be a miss,
+    # not something we unpickle into a possibly changed class layout.
+    key = md5(repr((str(filename), babel.__version__,
+                    sorted(kwargs.items()))).encode('utf-8')).hexdigest()
+    cache_file = os.path.join(cache_dir, key)
+    try:
+        with open(cache_file, 'rb') as f:
+            mtime, size, catalog = pickle.load(f)
+        if (mtime, size) == (st.st_mtime_ns, st.st_size):
+            return catalog
+    except Exception:
+        # Treat cache trouble of any kind - missing or truncated
+        # entries, but also whatever unpickling foreign data may
+        # raise - as a miss; the cache must never break a run that
+        # would work without it.
+        pass
+
+    catalog = _parse_catalog(filename, **kwargs)
     try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_file, 'wb') as f:
+            pickle.dump((st.st_mtime_ns, st.st_size, catalog), f,
+                        pickle.HIGHEST_PROTOCOL)
+    except (OSError, pickle.PickleError):
+        # Not being able to cache is no reason to fail the command.
+        pass
+    return catalog
+
+
+def _parse_catalog(filename, **kwargs):
+    with open(filename, 'r', encoding='utf-8',
+              buffering=FILE_BUFFER_SIZE) as f:
         return pofile.read_po(f, **kwargs)
-    finally:
-        f.close()
 
 
-def catalog2string(catalog, **kwargs):
-    """Helper that returns a babel message catalog as a string.
+def catalog2file(catalog, fileobj, **kwargs):
+    """Helper that writes a babel message catalog straight to an open
+    binary file, without building the serialized form in memory first.
+    """
+    pofile.write_po(fileobj, catalog, **kwargs)
 
-    This is a simple shortcut around pofile.write_po().
+
+def catalog2bytes(catalog, **kwargs):
+    """Helper that returns a babel message catalog as utf-8 bytes.
+
+    Write paths should prefer this over ``catalog2string``: the file
+    ends up utf-8 encoded anyway, so decoding the buffer just to
+    re-encode it later is wasted work. The returned object is really
+    a memoryview of the serialization buffer - getvalue() would give
+    us a second full copy of the catalog just to throw the first one
+    away. Everything downstream (comparison, hashing, file writes)
+    handles the view like bytes.
     """
     sf = BytesIO()
-    pofile.write_po(sf, catalog, **kwargs)
-    return sf.getvalue().decode('utf-8')
+    catalog2file(catalog, sf, **kwargs)
+    return sf.getbuffer()
+
+
+def catalog2string(catalog, **kwargs):
+    """Helper that returns a babel message catalog as a string.
+    """
+    return catalog2bytes(catalog, **kwargs).tobytes().decode('utf-8')
 
 
-def xml2string(tree, action):
-    """Helper that returns a ``ResourceTree`` as an XML string.
+def xml2bytes(tree, action):
+    """Helper that returns a ``ResourceTree`` as utf-8 XML bytes.
+
+    lxml's serializer produces encoded bytes anyway, and that is also
+    what ends up on disk; round-tripping through a decoded string
+    would just cost an extra copy.
 
     TODO: It would be cool if this could try to recreate the formatting
     of the original xml file.
@@ -51,7 +128,7 @@ def xml2string(tree, action):
     ENCODING = 'utf-8'
     dom = convert.write_xml(tree, warnfunc=action.message)
     return etree.tostring(dom, xml_declaration=True,
-                          encoding=ENCODING, pretty_print=True).decode('utf-8')
+                          encoding=ENCODING, pretty_print=True)
 
 
 def read_xml(action, filename, **kw):
@@ -72,11 +149,12 @@ def xml2po(env, action, *a, **kw):
     """Wrapper around the base xml2po() that uses the filters configured
     by the environment.
     """
-    def xml_filter(name):
-        for filter in env.config.ignores:
-            if filter.match(name):
-                return True
-    kw['resfilter'] = xml_filter
+    # env.init() folds all the ignore filters into a single compiled
+    # regex; when there are none, don't install a filter at all, so
+    # the converter skips the per-element callback entirely.
+    ignore_re = env.config.ignores
+    if ignore_re is not None:
+        kw['resfilter'] = lambda name: ignore_re.match(name) is not None
     if action:
         kw['warnfunc'] = action.message
     return convert.xml2po(*a, **kw)
@@ -94,14 +172,79 @@ def po2xml(env, action, *a, **kw):
     return convert.po2xml(*a, **kw)
 
 
+def fast_catalog_update(catalog, template):
+    """Merge ``template`` into ``catalog``, matching messages purely by
+    their (id, context) key.
+
+    Android resource ids are stable, so exact key matching is all we
+    ever need; a dict lookup per message keeps the merge linear, while
+    ``Catalog.update()`` carries a lot of bookkeeping to support its
+    fuzzy-matching path even when that is disabled. The semantics we
+    rely on are preserved: existing translations (and their flags and
+    user comments) are carried over, translations whose key is gone
+    from the template end up in ``catalog.obsolete``.
+
+    One deliberate difference to ``Catalog.update()``: the template's
+    creation date is *not* copied into the catalog. The template is
+    regenerated with a fresh timestamp on every run, so copying it
+    would change the POT-Creation-Date header - and therefore the
+    serialized .po file - on runs where nothing else changed, which
+    is exactly what the unchanged-file check in ``write_file()``
+    exists to detect.
+    """
+    remaining = catalog._messages.copy()
+    catalog._messages = OrderedDict()
+
+    for message in template:
+        if not message.id:
+            continue
+        key = catalog._key_for(message.id, message.context)
+        oldmsg = remaining.pop(key, None)
+        message = message.clone()
+        if oldmsg is not None:
+            fuzzy = False
+            message.string = oldmsg.string
+            message.user_comments = list(oldmsg.user_comments)
+            # Deal with the plural-ness of the message having changed;
+            # this mirrors what babel's merge does.
+            if isinstance(message.id, (list, tuple)):
+                if not isinstance(message.string, (list, tuple)):
+                    fuzzy = True
+                    message.string = tuple(
+                        [message.string] + ([''] * (len(message.id) - 1)))
+                elif len(message.string) != catalog.num_plurals:
+                    fuzzy = True
+                    message.string = tuple(
+                        message.string[:len(oldmsg.string)])
+            elif isinstance(message.string, (list, tuple)):
+                fuzzy = True
+                message.string = message.string[0]
+            message.flags |= oldmsg.flags
+            if fuzzy:
+                message.flags |= set(['fuzzy'])
+        catalog[message.id] = message
+
+    for key, msg in remaining.items():
+        catalog.obsolete[key] = msg
+
+
 def get_catalog_counts(catalog):
     """Return 3-tuple (total count, number of translated strings, number
     of fuzzy strings), based on the given gettext catalog.
     """
-    # Make sure we don't count the header
-    return (len(catalog),
-            len([m for m in catalog if m.string and m.id]),
-            len([m for m in catalog if m.string and m.id and m.fuzzy]))
+    total = translated = fuzzy = 0
+    # Iterating the catalog object itself would rebuild the mime
+    # header message on every call; its message store never contains
+    # the header, so walking that directly both skips the rebuild and
+    # makes the "don't count the header" check unnecessary. The fuzzy
+    # check is inlined (Message.fuzzy is a property doing just this).
+    for m in catalog._messages.values():
+        total += 1
+        if m.string:
+            translated += 1
+            if 'fuzzy' in m.flags:
+                fuzzy += 1
+    return total, translated, fuzzy
 
 
 def list_languages(source, env, writer):
@@ -125,6 +268,71 @@ def list_languages(source, env, writer):
     return languages
 
 
+def process_languages(func, languages):
+    """Call ``func`` once for every language, and return the list of
+    results, in order.
+
+    The languages are completely independent of each other, so when
+    there is more than one, the calls are spread over a small thread
+    pool. Most of the per-language work happens in lxml and in file
+    I/O, both of which release the GIL.
+    """
+    languages = list(languages)
+    if len(languages) <= 1:
+        return [func(language) for language in languages]
+    workers = min(len(languages), os.cpu_count() or 1)
+    with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(func, languages))
+
+
+# Process-local memo of file digests, keyed on (path, mtime, size); as
+# long as a file's stat data is unchanged, we can reuse the digest and
+# skip re-reading the file. Mainly pays off on re-runs of init/export
+# over many unchanged files.
+_hash_cache = {}
+
+
+def cached_hash(filename):
+    """Return ``filename.hash()``, memoized on the file's stat data.
+    """
+    st = os.stat(filename)
+    key = (str(filename), st.st_mtime_ns, st.st_size)
+    try:
+        return _hash_cache[key]
+    except KeyError:
+        digest = filename.hash()
+        _hash_cache[key] = digest
+        return digest
+
+
+def dir_entries(cmd, dirname):
+    """Return the set of names inside ``dirname``, or ``None`` if the
+    directory does not exist.
+
+    The listing is cached on the command; a command run touches the
+    same few directories over and over (once per language and kind),
+    and a single scandir() replaces all the individual stat() probes
+    that exists() checks would otherwise issue. Writes done through
+    ``write_file`` and ``ensure_directories`` keep the cache current.
+    """
+    try:
+        return cmd._dir_cache[dirname]
+    except KeyError:
+        try:
+            entries = set(e.name for e in os.scandir(dirname))
+        except OSError:
+            entries = None
+        cmd._dir_cache[dirname] = entries
+        return entries
+
+
+def file_exists(cmd, filename):
+    """Stat-cache backed version of ``filename.exists()``.
+    """
+    entries = dir_entries(cmd, filename.dir)
+    return entries is not None and os.path.basename(filename) in entries
+
+
 def ensure_directories(cmd, path):
     """Ensure that the given directory exists.
     """
@@ -132,19 +340,44 @@ def ensure_directories(cmd, path):
     # Yes, I know about os.makedirs(), but I'd like to print out
     # every single directory created.
     needs_creating = []
-    while not path.exists():
-        if path in needs_creating:
-            break
+    while dir_entries(cmd, path) is None:
         needs_creating.append(path)
-        path = path.dir
+        parent = path.dir
+        if parent == path:
+            # Filesystem root; can't walk up any further.
+            break
+        path = parent
 
     for path in reversed(needs_creating):
         cmd.w.action('mkdir', path)
         os.mkdir(path)
+        cmd._dir_cache[path] = set()
+        parent = cmd._dir_cache.get(os.path.dirname(path))
+        if parent is not None:
+            parent.add(os.path.basename(path))
+
+
+# Not all platforms (Windows, in particular) can open files relative
+# to a directory file descriptor; fall back to full paths there.
+_HAS_DIR_FD = os.open in os.supports_dir_fd
+_HAS_REPLACE_DIR_FD = os.replace in os.supports_dir_fd
+
+
+# The empty resource file the init command creates for every language
+# and kind. The content never varies, so encode it once; write_file()
+# compares against these bytes to recognize targets that already
+# contain exactly this data.
+EMPTY_XML = """<?xml version='1.0' encoding='utf-8'?>\n<resources>\n</resources>"""
+EMPTY_XML_BYTES = EMPTY_XML.encode('utf-8')
+
+
+# Above this size we compare file digests rather than keeping the whole
+# old file in memory; everything we usually write is far below it.
+IN_MEMORY_COMPARE_LIMIT = 1 << 20
 
 
 def write_file(cmd, filename, content, update=True, action=None,
-               ignore_exists=False):
+               ignore_exists=False, dir_fd=None):
     """Helper that writes a file, while sending the proper actions
     to the command's writer for stdout display of what's going on.
 
@@ -160,44 +393,96 @@ def write_file(cmd, filename, content, update=True, action=None,
     out messages. Otherwise, a new action will be started using the
     filename as the text. If ``action`` is ``False``, nothing will be
     printed.
+
+    If ``dir_fd`` is given, it must be an open file descriptor for the
+    directory containing ``filename``, and the write will be done
+    relative to it. Callers that write many files into the same
+    directory can open it once and spare the kernel from resolving
+    the full path again for every single file.
+
+    Returns ``True`` if the file was actually written; ``False`` if it
+    was left alone, either because ``update`` is disabled and it
+    exists, or because it already contains exactly the content we
+    would have written.
     """
     if action is None:
         action = cmd.w.begin(filename)
 
-    if filename.exists():
+    existed = file_exists(cmd, filename)
+    old_bytes = old_hash = None
+    if existed:
         if not update:
             if ignore_exists:
                 # Downgade level of this message
                 action.update(severity='info')
             action.done('exists')
             return False
+        # Remember what the file currently contains, so we can tell
+        # whether we would actually change anything. Our files are
+        # small, so holding the old bytes and comparing directly is
+        # cheaper than hashing the file twice; should we ever meet a
+        # huge file, fall back to digests.
+        if os.stat(filename).st_size <= IN_MEMORY_COMPARE_LIMIT:
+            with open(filename, 'rb', buffering=FILE_BUFFER_SIZE) as f:
+                old_bytes = f.read()
         else:
-            old_hash = filename.hash()
+            old_hash = cached_hash(filename)
+
+    if callable(content):
+        content = content()
+    if content is EMPTY_XML:
+        content_bytes = EMPTY_XML_BYTES
+    elif isinstance(content, (bytes, memoryview)):
+        content_bytes = content
     else:
-        old_hash = None
+        content_bytes = content.encode('utf-8')
+
+    # If the target already holds exactly this content, don't rewrite
+    # it. Besides saving the syscalls, this leaves the mtime alone,
+    # which any incremental build tool watching the resource files
+    # will appreciate.
+    if existed and (old_bytes == content_bytes if old_bytes is not None
+                    else old_hash == make_hasher(content_bytes).digest()):
+        if action is not False:
+            action.done('unchanged')
+        return False
 
     ensure_directories(cmd, filename.dir)
 
-    f = open(filename, 'wb')
+    # Write to a temporary file next to the target and move it into
+    # place once it is complete; os.replace() is atomic, so a crash
+    # mid-write leaves the old file intact instead of a truncated one.
+    basename = os.path.basename(filename)
+    tmpname = '.%s.tmp' % basename
+    tmppath = os.path.join(filename.dir, tmpname)
     try:
-        if isinstance(content, collections.Callable):
-            content = content()
-        f.write(content.encode('utf-8'))
-        f.flush()
-    finally:
-        f.close()
+        if dir_fd is not None and _HAS_DIR_FD:
+            fd = os.open(tmpname, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o666, dir_fd=dir_fd)
+            with os.fdopen(fd, 'wb', FILE_BUFFER_SIZE) as f:
+                f.write(content_bytes)
+            if _HAS_REPLACE_DIR_FD:
+                os.replace(tmpname, basename,
+                           src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+            else:  # pragma: no cover
+                os.replace(tmppath, filename)
+        else:
+            with open(tmppath, 'wb', buffering=FILE_BUFFER_SIZE) as f:
+                f.write(content_bytes)
+            os.replace(tmppath, filename)
+    except BaseException:
+        try:
+            os.unlink(tmppath)
+        except OSError:
+            pass
+        raise
+
+    entries = cmd._dir_cache.get(filename.dir)
+    if entries is not None:
+        entries.add(os.path.basename(filename))
 
     if action is not False:
-        if old_hash is None:
-            action.done('created')
-        elif old_hash != filename.hash():
-            action.done('updated')
-        else:
-            # Note that this is merely for user information. We
-            # nevertheless wrote a new version of the file, we can't
-            # actually determine a change without generating the new
-            # version.
-            action.done('unchanged')
+        action.done('created' if not existed else 'updated')
     return True
 
 
@@ -205,9 +490,15 @@ class Command(object):
     """Abstract base command class.
     """
 
+    # No instance dict; commands only carry the environment, the writer,
+    # the directory-listing cache and whatever slots subclasses declare.
+    __slots__ = ('env', 'w', '_dir_cache')
+
     def __init__(self, env, writer):
         self.env = env
         self.w = writer
+        # See dir_entries() for what this caches.
+        self._dir_cache = {}
 
     @classmethod
     def setup_arg_parser(cls, argparser):
@@ -223,12 +514,40 @@ class InitCommand(Command):
     """The init command; to initialize new languages.
     """
 
+    __slots__ = ('_template_catalogs', '_default_xml', '_memo_lock')
+
+    def __init__(self, env, writer):
+        super(InitCommand, self).__init__(env, writer)
+        # These memos may be filled lazily from the per-language worker
+        # threads (the export command gets here with a cold cache when
+        # templates are disabled), so they exist from the start and all
+        # access goes through a lock; otherwise two workers could both
+        # parse the same file, or one could observe the other's
+        # half-built state.
+        self._template_catalogs = {}
+        self._default_xml = {}
+        self._memo_lock = threading.RLock()
+
     @classmethod
     def setup_arg_parser(cls, parser):
         parser.add_argument('language', nargs='*',
                             help='Language code to initialize. If none given, all '+
                             'languages lacking a .po file will be initialized.')
 
+    def get_default_data(self, kind, action):
+        """Read the language-neutral XML file for ``kind``, memoized.
+
+        Both the template generation and the per-language iteration
+        need this data; without the memo the same values/ file would
+        be parsed once per language. Parse warnings (or a parse
+        failure) only reach the action that first requested the file.
+        """
+        with self._memo_lock:
+            if kind not in self._default_xml:
+                self._default_xml[kind] = read_xml(
+                    action, self.env.default.xml(kind))
+            return self._default_xml[kind]
+
     def make_or_get_template(self, kind, read_action=None, do_write=False,
                              update=True):
         """Return the .pot template file (as a Catalog) for the given kind.
@@ -245,42 +564,41 @@ class InitCommand(Command):
         and on subsequent access the cached version is returned.
         """
         # Implement caching - only generate the catalog the first time
-        # this function is called.
-        if not hasattr(self, '_template_catalogs'):
-            self._template_catalogs = {}
-
-        if kind in self._template_catalogs:
-            return self._template_catalogs[kind], False
-
-        # Only one, xor the other.
-        assert read_action or do_write and not (read_action and do_write)
-
-        template_pot = self.env.default.po(kind)
-        if do_write:
-            action = self.w.begin(template_pot)
-        else:
-            action = read_action
-
-        # Read the XML, bail out if that fails
-        xmldata = read_xml(action, self.env.default.xml(kind))
-        if xmldata is False:
-            return False, False
-
-        # Actually generate the catalog
-        template_catalog = xml2po(self.env, action, xmldata)
-        self._template_catalogs[kind] = template_catalog
-
-        # Write the catalog as a template to disk if necessary.
-        something_written = False
-        if do_write:
-            # Note that this is always rendered with "ignore_exists",
-            # i.e. we only log this action if we change the template.
-            if write_file(self, template_pot,
-                          content=lambda: catalog2string(template_catalog, width=self.env.config.width),
-                          action=action, ignore_exists=True, update=update):
-                something_written = True
+        # this function is called. The lock keeps concurrent workers
+        # from generating the same template twice.
+        with self._memo_lock:
+            if kind in self._template_catalogs:
+                return self._template_catalogs[kind], False
+
+            # Only one, xor the other.
+            assert read_action or do_write and not (read_action and do_write)
+
+            template_pot = self.env.default.po(kind)
+            if do_write:
+                action = self.w.begin(template_pot)
+            else:
+                action = read_action
+
+            # Read the XML, bail out if that fails
+            xmldata = self.get_default_data(kind, action)
+            if xmldata is False:
+                return False, False
+
+            # Actually generate the catalog
+            template_catalog = xml2po(self.env, action, xmldata)
+            self._template_catalogs[kind] = template_catalog
+
+            # Write the catalog as a template to disk if necessary.
+            something_written = False
+            if do_write:
+                # Note that this is always rendered with "ignore_exists",
+                # i.e. we only log this action if we change the template.
+                if write_file(self, template_pot,
+                              content=lambda: catalog2bytes(template_catalog, width=self.env.config.width),
+                              action=action, ignore_exists=True, update=update):
+                    something_written = True
 
-        return template_catalog, something_written
+            return template_catalog, something_written
 
     def generate_templates(self, update=True):
         """Generate the template files.
@@ -332,11 +650,15 @@ class InitCommand(Command):
                                'without translations')
                 lang_catalog = xml2po(self.env, action, default_data)
 
-            catalog = catalog2string(lang_catalog, width=self.env.config.width)
+            catalog = catalog2bytes(lang_catalog, width=self.env.config.width)
 
-            num_total, num_translated, _ = get_catalog_counts(lang_catalog)
-            action.message("%d strings processed, %d translated." % (
-                num_total, num_translated))
+            # The counts only feed an 'info'-level message; at default
+            # verbosity that message is dropped, so don't even walk the
+            # catalog to compute them then.
+            if action.writer.allowed('info'):
+                num_total, num_translated, _ = get_catalog_counts(lang_catalog)
+                action.message("%d strings processed, %d translated." % (
+                    num_total, num_translated))
             return catalog
 
         return write_file(self, target_po_file, content=make_catalog,
@@ -357,11 +679,13 @@ class InitCommand(Command):
         one .po file, i.e. on export, multiple xml files needs to be able
         to yield into a single .po target.
         """
-        for kind in self.env.xmlfiles:
+        env = self.env
+        w = self.w
+        for kind in env.xmlfiles:
             language_po = language.po(kind)
             language_xml = language.xml(kind)
 
-            action = self.w.begin(language_po)
+            action = w.begin(language_po)
 
             language_data = None
             if not language_xml.exists():
@@ -378,7 +702,7 @@ class InitCommand(Command):
                     # File was invalid
                     continue
 
-            template_data = read_xml(action, self.env.default.xml(kind))
+            template_data = self.get_default_data(kind, action)
             if template_data is False:
                 # File was invalid
                 continue
@@ -427,11 +751,22 @@ class InitCommand(Command):
 
             # Also for each language, generate the empty .xml resource files.
             # This will make us pick up the language on subsequent runs.
-            for kind in self.env.xmlfiles:
-                if write_file(self, language.xml(kind),
-                              """<?xml version='1.0' encoding='utf-8'?>\n<resources>\n</resources>""",
-                              update=False, ignore_exists=show_exists):
-                    something_done = True
+            # All those files live in the same values-XX directory, so we
+            # open that directory once and write each file relative to it.
+            language_xmls = [language.xml(kind) for kind in self.env.xmlfiles]
+            dir_fd = None
+            if language_xmls and _HAS_DIR_FD:
+                ensure_directories(self, language_xmls[0].dir)
+                dir_fd = os.open(language_xmls[0].dir, os.O_RDONLY)
+            try:
+                for target_xml in language_xmls:
+                    if write_file(self, target_xml, EMPTY_XML,
+                                  update=False, ignore_exists=show_exists,
+                                  dir_fd=dir_fd):
+                        something_done = True
+            finally:
+                if dir_fd is not None:
+                    os.close(dir_fd)
 
         if not something_done:
             self.w.action('info', 'Nothing to do.', 'default')
@@ -444,6 +779,8 @@ class ExportCommand(InitCommand):
     Both commands need to write the templates.
     """
 
+    __slots__ = ()
+
     @classmethod
     def setup_arg_parser(cls, parser):
         parser.add_argument(
@@ -451,9 +788,78 @@ class ExportCommand(InitCommand):
             help='Language code to export. If not given, all '+
                  'initialized languages will be exported.')
 
-    def execute(self):
+    def process(self, language):
+        """Process a single language for the export command.
+
+        Returns ``True`` if a .po file of the language was missing and
+        had to be skipped.
+        """
         env = self.env
         w = self.w
+        initial_warning = False
+
+        for kind in env.xmlfiles:
+            target_po = language.po(kind)
+            if not target_po.exists():
+                action = w.action('skipped', target_po)
+                action.message('File does not exist yet. '+
+                               'Use the \'init\' command.')
+                initial_warning = True
+                continue
+
+            action = w.begin(target_po)
+            # If we do not provide a locale, babel will consider this
+            # catalog a template and always write out the default
+            # header. It seemingly does not consider the "Language"
+            # header inside the file at all, and indeed deletes it.
+            # TODO: It deletes all headers it doesn't know, and
+            # overrides others. That sucks.
+            lang_catalog = read_catalog(target_po, cache_dir=env.cache_dir,
+                                        locale=language.code)
+            catalog, _ = self.make_or_get_template(kind, action)
+            if catalog is None:
+                # Something went wrong parsing the catalog
+                continue
+            if env.config.enable_fuzzy_matching:
+                lang_catalog.update(catalog, no_fuzzy_matching=False)
+            else:
+                # With stable Android resource ids, a plain key-based
+                # merge does the same job in linear time.
+                fast_catalog_update(lang_catalog, catalog)
+
+            # Making monkey patching: getting values from obsolete values and
+            # setting them as the new ones while marking message fuzzy
+            for message in lang_catalog:
+                for key in lang_catalog.obsolete:
+                    if key == "":
+                        continue
+                    if message.context == key[1]:
+                        obsolete_message = lang_catalog.obsolete[key]
+                        message.string = obsolete_message.string
+                        message.flags.add('fuzzy')
+            # Clearing obsolete messages
+            if env.config.clear_obsolete:
+                lang_catalog.obsolete.clear()
+
+            # Set the correct plural forms.
+            current_plurals = lang_catalog.plural_forms
+            convert.set_catalog_plural_forms(lang_catalog, language)
+            if lang_catalog.plural_forms != current_plurals:
+                action.message(
+                    'The Plural-Forms header of this catalog '
+                    'has been updated to what android2po '
+                    'requires for plurals support. See the '
+                    'README for more information.', 'warning')
+
+            # TODO: Should we include previous?
+            write_file(self, target_po,
+                       catalog2bytes(lang_catalog, include_previous=False, width=env.config.width),
+                       action=action)
+
+        return initial_warning
+
+    def execute(self):
+        env = self.env
 
         # First, always update the template files. Note that even if
         # template generation is disabled, we still need to have the
@@ -464,63 +870,10 @@ class ExportCommand(InitCommand):
         # we simply merge subsequent updates in?
         self.generate_templates()
 
-        initial_warning = False
-
-        for language in self.yield_languages(env, 'gettext'):
-            for kind in self.env.xmlfiles:
-                target_po = language.po(kind)
-                if not target_po.exists():
-                    w.action('skipped', target_po)
-                    w.message('File does not exist yet. '+
-                              'Use the \'init\' command.')
-                    initial_warning = True
-                    continue
+        missing = process_languages(self.process,
+                                    self.yield_languages(env, 'gettext'))
 
-                action = w.begin(target_po)
-                # If we do not provide a locale, babel will consider this
-                # catalog a template and always write out the default
-                # header. It seemingly does not consider the "Language"
-                # header inside the file at all, and indeed deletes it.
-                # TODO: It deletes all headers it doesn't know, and
-                # overrides others. That sucks.
-                lang_catalog = read_catalog(target_po, locale=language.code)
-                catalog, _ = self.make_or_get_template(kind, action)
-                if catalog is None:
-                    # Something went wrong parsing the catalog
-                    continue
-                lang_catalog.update(catalog,
-                                    no_fuzzy_matching=not env.config.enable_fuzzy_matching)
-
-                # Making monkey patching: getting values from obsolete values and
-                # setting them as the new ones while marking message fuzzy
-                for message in lang_catalog:
-                    for key in lang_catalog.obsolete:
-                        if key == "":
-                            continue
-                        if message.context == key[1]:
-                            obsolete_message = lang_catalog.obsolete[key]
-                            message.string = obsolete_message.string
-                            message.flags.add('fuzzy')
-                # Clearing obsolete messages
-                if env.config.clear_obsolete:
-                    lang_catalog.obsolete.clear()
-
-                # Set the correct plural forms.
-                current_plurals = lang_catalog.plural_forms
-                convert.set_catalog_plural_forms(lang_catalog, language)
-                if lang_catalog.plural_forms != current_plurals:
-                    action.message(
-                        'The Plural-Forms header of this catalog '
-                        'has been updated to what android2po '
-                        'requires for plurals support. See the '
-                        'README for more information.', 'warning')
-
-                # TODO: Should we include previous?
-                write_file(self, target_po,
-                           catalog2string(lang_catalog, include_previous=False, width=self.env.config.width),
-                           action=action)
-
-        if initial_warning:
+        if any(missing):
             print("")
             print(colored("Warning: One or more .po files were skipped "+\
                   "because they did not exist yet. Use the 'init' command "+\
@@ -532,53 +885,61 @@ class ImportCommand(Command):
     """The import command.
     """
 
+    __slots__ = ()
+
     def process(self, language):
         """Process importing the given language.
         """
 
+        env = self.env
+        w = self.w
+        catalogs = {}
+
+        def get_catalog(kind):
+            if kind not in catalogs:
+                catalogs[kind] = catalog = read_catalog(
+                    language.po(kind), cache_dir=env.cache_dir)
+                catalog.language = language
+            return catalogs[kind]
+
         # In order to implement the --require-min-complete option, we need
         # to first determine the translation status across all .po catalogs
         # for this language. We can keep the catalogs in memory because we
-        # will need them later anyway.
-        catalogs = {}
-        count_total = 0
-        count_translated = 0
-        for kind in self.env.xmlfiles:
-            language_po = language.po(kind)
-            if not language_po.exists():
-                continue
-            catalogs[kind] = catalog = read_catalog(language_po)
-            catalog.language = language
-            ntotal, ntrans, nfuzzy = get_catalog_counts(catalog)
-            count_total += ntotal
-            count_translated += ntrans
-            if self.env.config.ignore_fuzzy:
-                count_translated -= nfuzzy
-
-        # Compare our count with what is required, if anything.
+        # will need them later anyway. Without a threshold configured the
+        # result would never be consulted, so skip the whole pre-pass and
+        # let the write loop below read each catalog on demand.
         skip_due_to_incomplete = False
-        min_required = self.env.config.min_completion
-        if count_total == 0:
-            actual_completeness = 1
-        else:
-            actual_completeness = count_translated / float(count_total)
+        actual_completeness = 1
+        min_required = env.config.min_completion
         if min_required:
+            count_total = 0
+            count_translated = 0
+            for kind in env.xmlfiles:
+                if not language.po(kind).exists():
+                    continue
+                ntotal, ntrans, nfuzzy = get_catalog_counts(get_catalog(kind))
+                count_total += ntotal
+                count_translated += ntrans
+                if env.config.ignore_fuzzy:
+                    count_translated -= nfuzzy
+            if count_total != 0:
+                actual_completeness = count_translated / float(count_total)
             skip_due_to_incomplete = actual_completeness < min_required
 
         # Now loop through the list of target files, and either create
         # them, or print a status message for each indicating that they
         # were skipped.
-        for kind in self.env.xmlfiles:
+        for kind in env.xmlfiles:
             language_xml = language.xml(kind)
             language_po = language.po(kind)
-            action = self.w.begin(language_xml)
+            action = w.begin(language_xml)
 
             if skip_due_to_incomplete:
                 # TODO: Creating a catalog object here is kind of clunky.
                 # Idially, we'd refactor convert.py so that we can use a
                 # dict to represent a resource XML file.
-                xmldata = po2xml(self.env, action, Catalog(locale=language.code))
-                write_file(self, language_xml, xml2string(xmldata, action),
+                xmldata = po2xml(env, action, Catalog(locale=language.code))
+                write_file(self, language_xml, xml2bytes(xmldata, action),
                            action=False)
                 action.done('skipped', status=('%s catalogs aren\'t '
                                                'complete enough - %.2f done' % (
@@ -588,12 +949,13 @@ class ImportCommand(Command):
 
             if not language_po.exists():
                 action.done('skipped')
-                self.w.message('%s doesn\'t exist' % language_po.rel, 'warning')
+                action.message('%s doesn\'t exist' % language_po.rel, 'warning')
                 continue
 
-            content = xml2string(po2xml(self.env, action, catalogs[kind]), action)
+            content = xml2bytes(
+                po2xml(env, action, get_catalog(kind)), action)
             write_file(self, language_xml, content, action=action)
 
     def execute(self):
-        for language in list_languages('gettext', self.env, self.w):
-            self.process(language)
+        process_languages(self.process,
+                          list_languages('gettext', self.env, self.w))
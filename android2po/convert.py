@@ -13,7 +13,7 @@ The process thus is:
 
 from __future__ import unicode_literals
 
-from itertools import chain
+import re
 from collections import namedtuple
 from lxml import etree
 from babel.messages import Catalog
@@ -41,6 +41,12 @@ class UnsupportedResourceError(Exception):
 WHITESPACE = ' \n\t'     # Whitespace that we collapse
 EOF = None
 
+# Any character that makes a piece of text subject to actual work in
+# ``convert_text()``: escapes, quotes, format detection, tag escaping,
+# tabs/newlines or runs of more than one space. Text free of all of
+# these passes through the scanner unchanged, which lets us skip it.
+NEEDS_CONVERT_RE = re.compile(r'[\\"%<>\t\n]|  ')
+
 
 # Some AOSP projects like to include xliff:* tags to annotate
 # strings with more information for translators. This is actually harder
@@ -88,13 +94,19 @@ def get_element_text(tag, name, warnfunc=dummy_warn):
 
         It handles most of the Android syntax rules: quoting, escaping,
         collapsing duplicate whitespace etc.
+
+        This runs for every piece of text in every resource, so it is
+        written as a single forward scan that appends to an output
+        list; splicing the input in place would make the whole pass
+        quadratic in the length of the string.
         """
         # '<' and '>' as literal characters inside a text need to be
-        # escaped; this is because we need to differentiate them to
-        # actual tags inside a resource string which we write to the
-        # .po file as literal '<', '>' characters. As a result, if the
-        # user puts &lt; inside his Android resource file, this is how
-        # it will end up in the .po file as well.
+        # escaped (see the emit step at the bottom of the loop); this
+        # is because we need to differentiate them to actual tags
+        # inside a resource string which we write to the .po file as
+        # literal '<', '>' characters. As a result, if the user puts
+        # &lt; inside his Android resource file, this is how it will
+        # end up in the .po file as well.
         # We only do this for '<' and '<' right now, which is of course
         # a hack. We'd need to process at least &amp; as well, because
         # right now '&lt;' and '&amp;lt;' both generate the same on
@@ -112,54 +124,57 @@ def get_element_text(tag, name, warnfunc=dummy_warn):
         # file. Instead of a comment, we could change the import code
         # to require a look at the original resource xml file to
         # determine which kind of encoding was done.
-        text = text.replace('<', '&lt;')
-        text = text.replace('>', "&gt;")
-
-        # We need to collapse multiple whitespace while paying
-        # attention to Android's quoting and escaping.
-        space_count = 0
+        out = []
+        append = out.append
+        # The current run of whitespace; we keep the actual characters
+        # around because a run inside quotes is preserved verbatim.
+        ws_run = []
         active_quote = False
         active_percent = False
         active_escape = False
         formatted = False
+
+        n = len(text)
         i = 0
-        text = list(text) + [EOF]
-        while i < len(text):
-            c = text[i]
-
-            # Handle whitespace collapsing
-            if c is not EOF and c in WHITESPACE:
-                space_count += 1
-            elif space_count > 1:
-                # Remove duplicate whitespace; Pay attention: We
-                # don't do this if we are currently inside a quote,
-                # except for one special case: If we have unbalanced
-                # quotes, e.g. we reach eof while a quote is still
-                # open, we *do* collapse that trailing part; this is
-                # how Android does it, for some reason.
-                if not active_quote or c is EOF:
-                    # Replace by a single space, will get rid of
-                    # non-significant newlines/tabs etc.
-                    text[i-space_count : i] = ' '
-                    i -= space_count - 1
-                space_count = 0
-            elif space_count == 1:
-                # At this point we have a single whitespace character,
-                # but it might be a newline or tab. If we write this
-                # kind of insignificant whitespace into the .po file,
-                # it will be considered significant on import. So,
-                # make sure that this kind of whitespace is always a
-                # standard space.
-                text[i-1] = ' '
-                space_count = 0
-            else:
-                space_count = 0
+        while i <= n:
+            c = text[i] if i < n else EOF
+
+            # Handle whitespace collapsing. The run is flushed when we
+            # meet the next non-whitespace character (or the end), at
+            # which point we know whether we are inside a quote.
+            if c is not EOF and not active_escape and c in WHITESPACE:
+                ws_run.append(c)
+                # The formatter state machine still needs to see this
+                # character (matches the generic case below).
+                if active_percent:
+                    formatted = True
+                    active_percent = False
+                i += 1
+                continue
+            if ws_run:
+                if len(ws_run) > 1 and active_quote and c is not EOF:
+                    # We don't collapse whitespace inside a quote,
+                    # except for one special case: If we have
+                    # unbalanced quotes, e.g. we reach eof while a
+                    # quote is still open, we *do* collapse that
+                    # trailing part; this is how Android does it, for
+                    # some reason.
+                    out.extend(ws_run)
+                else:
+                    # Replace by a single space. This also makes sure
+                    # a single newline or tab becomes a standard
+                    # space; if we write that kind of insignificant
+                    # whitespace into the .po file, it will be
+                    # considered significant on import.
+                    append(' ')
+                del ws_run[:]
+
+            emit = c is not EOF
 
             # Handle quotes
             if c == '"' and not active_escape:
                 active_quote = not active_quote
-                del text[i]
-                i -= 1
+                emit = False
 
             # If the string is run through a formatter, it will have
             # percentage signs for String.format
@@ -173,72 +188,65 @@ def get_element_text(tag, name, warnfunc=dummy_warn):
             if c == '\\':
                 if not active_escape:
                     active_escape = True
+                    emit = False
                 else:
-                    # A double-backslash represents a single;
-                    # simply deleting the current char will do.
-                    del text[i]
-                    i -= 1
+                    # A double-backslash represents a single one;
+                    # simply fall through to the emit step.
                     active_escape = False
-            else:
-                if active_escape:
-                    # Handle the limited amount of escape codes
-                    # that we support.
-                    # TODO: What about \r, or \r\n?
-                    if c is EOF:
-                        # Basically like any other char, but put
-                        # this first so we can use the ``in`` operator
-                        # in the clauses below without issue.
-                        pass
-                    elif c == 'n':
-                        text[i-1 : i+1] = '\n'  # an actual newline
-                        i -= 1
-                    elif c == 't':
-                        text[i-1 : i+1] = '\t'  # an actual tab
-                        i -= 1
-                    elif c in '"\'@':
-                        text[i-1 : i] = ''        # remove the backslash
-                        i -= 1
-                    elif c == 'u':
-                        # Unicode sequence. Android is nice enough to deal
-                        # with those in a way which let's us just capture
-                        # the next 4 characters and raise an error if they
-                        # are not valid (rather than having to use a new
-                        # state to parse the unicode sequence).
-                        # Exception: In case we are at the end of the
-                        # string, we support incomplete sequences by
-                        # prefixing the missing digits with zeros.
-                        # Note: max(len()) is needed in the slice due to
-                        # trailing ``None`` element.
-                        max_slice = min(i+5, len(text)-1)
-                        codepoint_str = "".join(text[i+1 : max_slice])
-                        if len(codepoint_str) < 4:
-                            codepoint_str = "0" * (4-len(codepoint_str)) + codepoint_str
-                        try:
-                            # We can't trust int() to raise a ValueError,
-                            # it will ignore leading/trailing whitespace.
-                            if not codepoint_str.isalnum():
-                                raise ValueError(codepoint_str)
-                            codepoint = chr(int(codepoint_str, 16))
-                        except ValueError as exc:
-                            raise UnsupportedResourceError('bad unicode escape sequence: %s' % exc)
-
-                        text[i-1 : max_slice] = codepoint
-                        i -= 1
-                    else:
-                        # All others, remove, like Android does as well.
-                        # However, Android does so silently, we show a
-                        # warning so the dev can fix the problem.
-                        warnfunc(('Resource "%s": removing unsupported '
-                                  'escape sequence "%s"') % (
-                                    name, "".join(text[i-1 : i+1])), 'warning')
-                        text[i-1 : i+1] = ''
-                        i -= 1
-                    active_escape = False
-
+            elif active_escape:
+                # Handle the limited amount of escape codes
+                # that we support.
+                # TODO: What about \r, or \r\n?
+                emit = False
+                if c is EOF:
+                    # A trailing backslash is left alone.
+                    append('\\')
+                elif c == 'n':
+                    append('\n')  # an actual newline
+                elif c == 't':
+                    append('\t')  # an actual tab
+                elif c in '"\'@':
+                    append(c)     # remove the backslash
+                elif c == 'u':
+                    # Unicode sequence. Android is nice enough to deal
+                    # with those in a way which let's us just capture
+                    # the next 4 characters and raise an error if they
+                    # are not valid (rather than having to use a new
+                    # state to parse the unicode sequence).
+                    # Exception: In case we are at the end of the
+                    # string, we support incomplete sequences by
+                    # prefixing the missing digits with zeros.
+                    codepoint_str = text[i+1:i+5]
+                    i += len(codepoint_str)
+                    if len(codepoint_str) < 4:
+                        codepoint_str = "0" * (4-len(codepoint_str)) + codepoint_str
+                    try:
+                        # We can't trust int() to raise a ValueError,
+                        # it will ignore leading/trailing whitespace.
+                        if not codepoint_str.isalnum():
+                            raise ValueError(codepoint_str)
+                        append(chr(int(codepoint_str, 16)))
+                    except ValueError as exc:
+                        raise UnsupportedResourceError('bad unicode escape sequence: %s' % exc)
+                else:
+                    # All others, remove, like Android does as well.
+                    # However, Android does so silently, we show a
+                    # warning so the dev can fix the problem.
+                    warnfunc(('Resource "%s": removing unsupported '
+                              'escape sequence "%s"') % (
+                                name, "\\" + c), 'warning')
+                active_escape = False
+
+            if emit:
+                if c == '<':
+                    append('&lt;')
+                elif c == '>':
+                    append('&gt;')
+                else:
+                    append(c)
             i += 1
 
-        # Join the string together again, but w/o EOF marker
-        return "".join(text[:-1]), formatted
+        return "".join(out), formatted
 
     def get_tag_name(elem):
         """For tags without a namespace, returns ("tag", None).
@@ -262,64 +270,98 @@ def get_element_text(tag, name, warnfunc=dummy_warn):
     # XML (including entities), *except* tags. Much more than that
     # though, the processing rules the Android xml format needs
     # require custom processing anyway.
-    value = ""
-    formatted = False
-    for ev, elem  in etree.iterwalk(tag, events=('start', 'end',)):
-        is_root = elem == tag
-        has_children = len(tag) > 0
-        if ev == 'start':
-            if not is_root:
-                # Take care of the tag name, namespace and attributes.
-                # Since we can't store namespace urls in a .po file, dealing
-                # with (unknown) namespaces requires generating a xmlns
-                # attribute.
-                # TODO: We are currently not dealing correctly with
-                # attribute values that need escaping.
-                tag_name, to_declare = get_tag_name(elem)
-                params = ["%s=\"%s\"" % (k, v) for k, v in list(elem.attrib.items())]
+    parts = []
+
+    def walk(elem):
+        """Render the children of ``elem`` (tags, text, tails) into
+        ``parts``, in document order. Returns whether any of the text
+        used format codes.
+
+        A direct recursive walk; iterwalk() would fire a Python-level
+        event per element, plus a root check per event, which is pure
+        overhead for the typically tiny trees we see here.
+        """
+        elem_formatted = False
+        for child in elem:
+            # Skip comments and processing instructions (their .tag is
+            # a function, not a string); they hold nothing translatable
+            # and rendering them as tags would put garbage into the
+            # .po file. Their tail text is dropped with them, which is
+            # what the old iterwalk()-based version did as well.
+            if not isinstance(child.tag, str):
+                continue
+            # Take care of the tag name, namespace and attributes.
+            # Since we can't store namespace urls in a .po file, dealing
+            # with (unknown) namespaces requires generating a xmlns
+            # attribute.
+            # TODO: We are currently not dealing correctly with
+            # attribute values that need escaping.
+            tag_name, to_declare = get_tag_name(child)
+            if child.attrib or to_declare:
+                params = ["%s=\"%s\"" % (k, v) for k, v in child.attrib.items()]
                 if to_declare:
                     name, url = to_declare
                     params.append('xmlns:%s="%s"' % (name, url))
-                params_str = " %s" % " ".join(params) if params else ""
-                value += "<%s%s>" % (tag_name, params_str)
-            if elem.text is not None:
-                t = elem.text
-                # Leading/Trailing whitespace is removed completely
-                # ONLY if there are no nested tags. Handle this before
-                # calling ``convert_text``, so that whitespace
-                # protecting quotes can still be considered.
-                if is_root and not has_children and len(tag) == 0:
-                    t = t.strip(WHITESPACE)
-
-                # Resources that start with @ reference other resources.
-                # While we aren't particularily interested in converting
-                # those, we also can't do it right now because we wouldn't
-                # be able to differ between literal @ characters and the
-                # reference syntax during import.
-                #
-                # While it may seem a bit early to deal with this here, we
-                # have no choice, because the caller needs *some* way of
-                # differentating between an escaped literal '@' and this
-                # kind of resource-reference. Since we unescape literals,
-                # we need to do something with the reference-@.
-                if is_root and not has_children and t and t[0] == '@':
-                    raise UnsupportedResourceError(
-                        'resource references (%s) are not supported' % t)
-
-                converted_value, elem_formatted = convert_text(t)
-                if elem_formatted:
-                    formatted = True
-                value += converted_value
-        elif ev == 'end':
-            # The closing root tag has no info for us at all.
-            if not is_root:
-                tag_name, _ = get_tag_name(elem)
-                value += "</%s>" % tag_name
-                if elem.tail is not None:
-                    converted_value, elem_formatted = convert_text(elem.tail)
-                    if elem_formatted:
-                        formatted = True
-                    value += converted_value
+                parts.append("<%s %s>" % (tag_name, " ".join(params)))
+            else:
+                parts.append("<%s>" % tag_name)
+            if child.text is not None:
+                converted_value, text_formatted = convert_text(child.text)
+                if text_formatted:
+                    elem_formatted = True
+                parts.append(converted_value)
+            if walk(child):
+                elem_formatted = True
+            parts.append("</%s>" % tag_name)
+            if child.tail is not None:
+                converted_value, text_formatted = convert_text(child.tail)
+                if text_formatted:
+                    elem_formatted = True
+                parts.append(converted_value)
+        return elem_formatted
+
+    if len(tag) == 0:
+        # Fast path: no nested markup, which is the overwhelmingly
+        # common case for Android resources.
+        #
+        # Leading/Trailing whitespace is removed completely ONLY if
+        # there are no nested tags. Handle this before calling
+        # ``convert_text``, so that whitespace protecting quotes can
+        # still be considered.
+        t = (tag.text or '').strip(WHITESPACE)
+
+        # Resources that start with @ reference other resources.
+        # While we aren't particularily interested in converting
+        # those, we also can't do it right now because we wouldn't
+        # be able to differ between literal @ characters and the
+        # reference syntax during import.
+        #
+        # While it may seem a bit early to deal with this here, we
+        # have no choice, because the caller needs *some* way of
+        # differentating between an escaped literal '@' and this
+        # kind of resource-reference. Since we unescape literals,
+        # we need to do something with the reference-@.
+        if t and t[0] == '@':
+            raise UnsupportedResourceError(
+                'resource references (%s) are not supported' % t)
+
+        if NEEDS_CONVERT_RE.search(t) is None:
+            # Nothing in the text that the scanner would touch (no
+            # escapes, quotes, format codes, tags or collapsible
+            # whitespace) - which is true for the vast majority of
+            # resources - so the stripped text already is the result.
+            value, formatted = t, False
+        else:
+            value, formatted = convert_text(t)
+    else:
+        formatted = False
+        if tag.text is not None:
+            converted_value, formatted = convert_text(tag.text)
+            parts.append(converted_value)
+        if walk(tag):
+            formatted = True
+        # The root's closing tag and tail hold no info for us at all.
+        value = "".join(parts)
 
     # Babel can't handle empty msgids, even when using a unique context;
     # not sure if this is a general gettext limitation, but it's not
@@ -330,10 +372,32 @@ def get_element_text(tag, name, warnfunc=dummy_warn):
     return value, formatted
 
 
+class EncodedFile(object):
+    """Minimal binary wrapper around a text-mode file object.
+
+    ``iterparse()``, unlike ``parse()``, insists on reading bytes;
+    this keeps supporting callers (and tests) that hand us a text
+    stream.
+    """
+
+    def __init__(self, f):
+        self._f = f
+
+    def read(self, size):
+        data = self._f.read(size)
+        if isinstance(data, bytes):
+            return data
+        return data.encode('utf-8')
+
+
 def read_xml(xml_file, language=None, warnfunc=dummy_warn):
     """Load all resource names from an Android strings.xml resource file.
 
     The result is a ``ResourceTree`` instance.
+
+    The file is parsed incrementally: every top-level element is handled
+    as soon as its closing tag is seen, and its subtree is freed right
+    after, so we never hold the full DOM in memory.
     """
 
     def check_formatted(forced_state, detected_state):
@@ -345,110 +409,136 @@ def read_xml(xml_file, language=None, warnfunc=dummy_warn):
     result = ResourceTree(language)
     comment = []
 
+    if hasattr(xml_file, 'read'):
+        xml_file = EncodedFile(xml_file)
+
+    # lxml uses the same sentinel object as the tag of every comment
+    # node; bind it locally so the loop pays one pointer compare per
+    # element instead of a module attribute lookup.
+    Comment = etree.Comment
+
     try:
-        doc = etree.parse(xml_file)
-    except etree.XMLSyntaxError as e:
-        raise InvalidResourceError(e)
+        for _, tag in etree.iterparse(xml_file, events=('end', 'comment'),
+                                      collect_ids=False):
+            # Only process nodes sitting directly below the <resources>
+            # root; nested tags (e.g. the <item>s of an array) are handled
+            # as part of their parent, and the root itself once all of its
+            # children are done holds nothing of interest anymore.
+            parent = tag.getparent()
+            if parent is None or parent.getparent() is not None:
+                continue
 
-    for tag in doc.getroot():
-        # Collect comments so we can add them to the element that they precede.
-        if tag.tag == etree.Comment:
-            comment.append(tag.text)
-            continue
+            # Collect comments so we can add them to the element that they precede.
+            if tag.tag is Comment:
+                comment.append(tag.text)
+                continue
 
-        # Ignore elements we cannot or should not process
-        if 'name' not in tag.attrib:
-            comment = []
-            continue
-        if tag.attrib.get('translatable') == 'false':
-            comment = []
-            continue
+            # Every ``.attrib`` access builds a new proxy object in
+            # lxml, and we consult it a number of times per element.
+            attrib = tag.attrib
 
-        name = tag.attrib['name']
-        if name in result:
-            warnfunc('Duplicate resource id found: %s, ignoring.' % name,
-                     'warning')
-            comment = []
-            continue
+            # Ignore elements we cannot or should not process
+            if 'name' not in attrib:
+                comment = []
+                continue
+            if attrib.get('translatable') == 'false':
+                comment = []
+                continue
+
+            name = attrib['name']
+            if name in result:
+                warnfunc('Duplicate resource id found: %s, ignoring.' % name,
+                         'warning')
+                comment = []
+                continue
 
-        # Check for the formatted attribute, to override strings which the
-        # developer says definitely do or do not contain format directives.
-        # TODO: add force_fmt as an argument to get_element_text, so we don't
-        # have to compare its result to the flag in every place it is used.
-        force_fmt = None
-        if 'formatted' in tag.attrib:
-            if tag.attrib['formatted'] == 'true':
+            # Check for the formatted attribute, to override strings which the
+            # developer says definitely do or do not contain format directives.
+            # TODO: add force_fmt as an argument to get_element_text, so we don't
+            # have to compare its result to the flag in every place it is used.
+            force_fmt = None
+            formatted_attr = attrib.get('formatted')
+            if formatted_attr == 'true':
                 force_fmt = True
-            elif tag.attrib['formatted'] == 'false':
+            elif formatted_attr == 'false':
                 force_fmt = False
 
-        if tag.tag == 'string':
-            try:
-                text, formatted = get_element_text(tag, name, warnfunc)
-            except UnsupportedResourceError as e:
-                warnfunc('"%s" has been skipped, reason: %s' % (
-                    name, e.reason), 'info')
-            else:
-                formatted = check_formatted(force_fmt, formatted)
-                translation = Translation(text, comment, formatted)
-                result[name] = translation
-
-        elif tag.tag == 'string-array':
-            result[name] = StringArray()
-            for child in tag.findall('item'):
+            if tag.tag == 'string':
                 try:
-                    text, formatted = get_element_text(child, name, warnfunc)
+                    text, formatted = get_element_text(tag, name, warnfunc)
                 except UnsupportedResourceError as e:
-                    # XXX: We currently can't handle this, because even if
-                    # we write out a .po file with the proper array
-                    # indices, and items like this one missing, during
-                    # import we still need to write out those items that
-                    # we have now skipped, since the Android format is only
-                    # a simple list of items, i.e. we need to specify the
-                    # fully array, and can't override individual items on
-                    # a per-translation basis.
-                    #
-                    # To fix this, we have two options: Either we support
-                    # annotating gettext messages, in which case we could
-                    # indicate whether or not a message like this was a
-                    # reference and should be escaped or not. Or, better,
-                    # the import process would need to use information from
-                    # the default strings.xml file to fill the vacancies.
-                    warnfunc(('Warning: The array "%s" contains items '+
-                              'that can\'t be processed (reason: %s) - '
-                              'the array will be incomplete') %
-                                    (name, e.reason), 'warning')
+                    warnfunc('"%s" has been skipped, reason: %s' % (
+                        name, e.reason), 'info')
                 else:
                     formatted = check_formatted(force_fmt, formatted)
                     translation = Translation(text, comment, formatted)
-                    result[name].append(translation)
+                    result[name] = translation
 
-        elif tag.tag == 'plurals':
-            result[name] = Plurals()
-            for child in tag.findall('item'):
-                try:
-                    quantity = child.attrib['quantity']
-                    assert quantity in PLURAL_TAGS
-                except (IndexError, AssertionError):
-                    warnfunc(('"%s" contains a plural with no or '+
-                              'an invalid quantity') % name, 'warning')
-                else:
+            elif tag.tag == 'string-array':
+                result[name] = StringArray()
+                for child in tag.iterchildren('item'):
                     try:
                         text, formatted = get_element_text(child, name, warnfunc)
                     except UnsupportedResourceError as e:
-                        warnfunc(('Warning: The plural "%s" can\'t '+
-                                  'be processed (reason: %s) - '
-                                  'the plural will be incomplete') %
-                                 (name, e.reason), 'warning')
+                        # XXX: We currently can't handle this, because even if
+                        # we write out a .po file with the proper array
+                        # indices, and items like this one missing, during
+                        # import we still need to write out those items that
+                        # we have now skipped, since the Android format is only
+                        # a simple list of items, i.e. we need to specify the
+                        # fully array, and can't override individual items on
+                        # a per-translation basis.
+                        #
+                        # To fix this, we have two options: Either we support
+                        # annotating gettext messages, in which case we could
+                        # indicate whether or not a message like this was a
+                        # reference and should be escaped or not. Or, better,
+                        # the import process would need to use information from
+                        # the default strings.xml file to fill the vacancies.
+                        warnfunc(('Warning: The array "%s" contains items '+
+                                  'that can\'t be processed (reason: %s) - '
+                                  'the array will be incomplete') %
+                                        (name, e.reason), 'warning')
                     else:
                         formatted = check_formatted(force_fmt, formatted)
                         translation = Translation(text, comment, formatted)
-                        result[name][quantity] = translation
+                        result[name].append(translation)
+
+            elif tag.tag == 'plurals':
+                result[name] = Plurals()
+                for child in tag.iterchildren('item'):
+                    try:
+                        quantity = child.attrib['quantity']
+                        assert quantity in PLURAL_TAGS
+                    except (IndexError, AssertionError):
+                        warnfunc(('"%s" contains a plural with no or '+
+                                  'an invalid quantity') % name, 'warning')
+                    else:
+                        try:
+                            text, formatted = get_element_text(child, name, warnfunc)
+                        except UnsupportedResourceError as e:
+                            warnfunc(('Warning: The plural "%s" can\'t '+
+                                      'be processed (reason: %s) - '
+                                      'the plural will be incomplete') %
+                                     (name, e.reason), 'warning')
+                        else:
+                            formatted = check_formatted(force_fmt, formatted)
+                            translation = Translation(text, comment, formatted)
+                            result[name][quantity] = translation
+
+            # We now have processed a tag. We either added those comments to
+            # the translation we created based on the tag, or the comments
+            # relate to a tag we do not support. In any case, dismiss them.
+            comment = []
+
 
-        # We now have processed a tag. We either added those comments to
-        # the translation we created based on the tag, or the comments
-        # relate to a tag we do not support. In any case, dismiss them.
-        comment = []
+            # Done with this subtree; free it so that memory stays
+            # bounded regardless of the file size.
+            tag.clear()
+            while tag.getprevious() is not None:
+                del parent[0]
+    except etree.XMLSyntaxError as e:
+        raise InvalidResourceError(e)
 
     return result
 
@@ -490,6 +580,13 @@ def set_catalog_plural_forms(catalog, language):
         pass
 
 
+# Shared flag sequences passed to ``Catalog.add()``; Babel copies the
+# flags into a fresh set per message, so sharing these saves a list
+# allocation per resource without any aliasing risk.
+CFORMAT_FLAGS = ('c-format',)
+NO_FLAGS = ()
+
+
 def xml2po(resources, translations=None, resfilter=None, warnfunc=dummy_warn):
     """Return ``resources`` as a Babel .po ``Catalog`` instance.
 
@@ -519,13 +616,17 @@ def xml2po(resources, translations=None, resfilter=None, warnfunc=dummy_warn):
         # See http://babel.edgewall.org/ticket/290.
         set_catalog_plural_forms(catalog, translations.language)
 
+    # Bound-method lookups hoisted out of the per-resource loop. The
+    # translations tree is only read, never consumed, so the same tree
+    # can safely be passed into multiple calls.
+    cat_add = catalog.add
+    trans_get = translations.get if translations is not None else None
+
     for name, org_value in resources.items():
         if resfilter and resfilter(name):
             continue
 
-        trans_value = None
-        if translations:
-            trans_value = translations.pop(name, trans_value)
+        trans_value = trans_get(name) if trans_get is not None else None
 
         if isinstance(org_value, StringArray):
             # a string-array, write as "name:index"
@@ -545,12 +646,10 @@ def xml2po(resources, translations=None, resfilter=None, warnfunc=dummy_warn):
 
                 # If the string has formatting markers, indicate it in
                 # the gettext output
-                flags = []
-                if item.formatted:
-                    flags.append('c-format')
+                flags = CFORMAT_FLAGS if item.formatted else NO_FLAGS
 
                 ctx = "%s:%d" % (name, index)
-                catalog.add(item.text, item_trans, auto_comments=item.comments,
+                cat_add(item.text, item_trans, auto_comments=item.comments,
                             flags=flags, context=ctx)
 
         elif isinstance(org_value, Plurals):
@@ -613,10 +712,8 @@ def xml2po(resources, translations=None, resfilter=None, warnfunc=dummy_warn):
                     else:
                         msgstr[index] = translation.text
 
-            flags = []
-            if formatted:
-                flags.append('c-format')
-            catalog.add(msgid, tuple(msgstr), flags=flags,
+            flags = CFORMAT_FLAGS if formatted else NO_FLAGS
+            cat_add(msgid, tuple(msgstr), flags=flags,
                         auto_comments=comments, context=name)
 
         else:
@@ -624,22 +721,62 @@ def xml2po(resources, translations=None, resfilter=None, warnfunc=dummy_warn):
 
             # If the string has formatting markers, indicate it in
             # the gettext output
-            # TODO DRY this.
-            flags = []
-            if org_value.formatted:
-                flags.append('c-format')
+            flags = CFORMAT_FLAGS if org_value.formatted else NO_FLAGS
 
-            catalog.add(org_value.text, trans_value.text if trans_value else '',
+            cat_add(org_value.text, trans_value.text if trans_value else '',
                         flags=flags, auto_comments=org_value.comments, context=name)
 
     if translations is not None:
-        # At this point, trans_strings only contains those for which
-        # no original existed.
-        return catalog, list(translations.keys())
+        # Report the translations for which no original existed. This
+        # used to work by pop()ing each match out of the tree, but a
+        # non-mutating diff lets callers keep reusing the tree.
+        # Resources suppressed by the filter never match, same as
+        # before.
+        unmatched = [name for name in translations
+                     if name not in resources
+                     or (resfilter and resfilter(name))]
+        return catalog, unmatched
     else:
         return catalog
 
 
+# Escapes applied when writing a value into an Android XML file; used
+# via str.translate(), which does all of them in a single C-level pass
+# over the string, rather than one full scan-and-copy per replace().
+# Strictly speaking, @ only needs to be escaped when it's the first
+# character. But, since our target XML files are basically
+# generate-only and unlikely to be edited by a user, don't bother
+# with pretty.
+ESCAPE_TABLE = str.maketrans({
+    '\\': '\\\\',
+    '\n': '\\n',
+    '\t': '\\t',
+    '\'': '\\\'',
+    '"': '\\"',
+    '@': '\\@',
+})
+
+
+# Matches '&' characters that do not start one of the entities we
+# preserve ('&lt;', '&gt;'); see the PREPROCESS step in write_to_dom().
+ENTITY_AMP_RE = re.compile(r'&(?!lt;|gt;)')
+
+
+# Text written to an Android XML file needs to be protected by quotes
+# if it has leading, trailing or consecutive whitespace. This runs on
+# text already passed through ESCAPE_TABLE, which leaves the space
+# character as the only whitespace that can still occur.
+NEEDS_QUOTING_RE = re.compile(r'^ | $|  ')
+
+
+# The xmlns attributes for the wrapper element write_to_dom() parses
+# values with; this never changes, so build the string once rather
+# than for every message.
+WRAPPER_NAMESPACE_TEXT = " ".join(
+    ['xmlns:%s="%s"' % (prefix, ns)
+     for ns, prefix in list(KNOWN_NAMESPACES.items())])
+
+
 def write_to_dom(elem_name, value, ref, namespaces=None, warnfunc=dummy_warn):
     """Create a DOM object with the tag name ``elem_name``, containing
     the string ``value`` formatted according to Android XML rules.
@@ -659,8 +796,6 @@ def write_to_dom(elem_name, value, ref, namespaces=None, warnfunc=dummy_warn):
     proper declarations.
     """
 
-    loose_parser = etree.XMLParser(recover=True)
-
     if value is None:
         value = ''
 
@@ -675,9 +810,12 @@ def write_to_dom(elem_name, value, ref, namespaces=None, warnfunc=dummy_warn):
     # properly?
     # TODO: In particular, the code below will once we do anything
     # bit more complicated with entities, like &amp;amp;lt;
-    value = value.replace('&', '&amp;')
-    value = value.replace('&amp;lt;', '&lt;')
-    value = value.replace('&amp;gt;', '&gt;')
+    #
+    # (A single regex pass: every '&' not already starting '&lt;' or
+    # '&gt;' becomes '&amp;'. Equivalent to escaping all ampersands
+    # and then restoring those two entities, without scanning and
+    # copying the string three times.)
+    value = ENTITY_AMP_RE.sub('&amp;', value)
 
     # PARSE
     #
@@ -687,11 +825,14 @@ def write_to_dom(elem_name, value, ref, namespaces=None, warnfunc=dummy_warn):
     # (https://answers.launchpad.net/lxml/+question/111660).
     # So we use a wrapping element with xmlns attributes that we ignore
     # after parsing.
-    namespace_text = " ".join(['xmlns:%s="%s"' % (prefix, ns) for ns, prefix in list(KNOWN_NAMESPACES.items())])
-    value_to_parse = "<root %s><%s>%s</%s></root>" % (namespace_text, elem_name, value, elem_name)
+    value_to_parse = "<root %s><%s>%s</%s></root>" % (
+        WRAPPER_NAMESPACE_TEXT, elem_name, value, elem_name)
     try:
         elem = etree.fromstring(value_to_parse)
     except etree.XMLSyntaxError as e:
+        # Only build the recovering parser when we actually need it;
+        # the happy path shouldn't pay for it on every message.
+        loose_parser = etree.XMLParser(recover=True)
         elem = etree.fromstring(value_to_parse, loose_parser)
         warnfunc(('%s contains invalid XHTML (%s); Falling back to '
                   'loose parser.') % (ref, e), 'warning')
@@ -708,56 +849,42 @@ def write_to_dom(elem_name, value, ref, namespaces=None, warnfunc=dummy_warn):
     # Then, proceed with the actual element that we wanted to create.
     elem = elem[0]
 
-    def quote(text):
-        """Return ``text`` surrounded by quotes if necessary.
+    def escape_and_quote(text):
+        """Escape all the characters we know need to be escaped in an
+        Android XML file, and surround the result by quotes if it
+        contains whitespace that needs protecting.
+
+        One function rather than separate escape()/quote() steps, so
+        the walk below pays a single call and a single None/empty
+        check per text node (and most tails are empty).
         """
-        if text is None:
-            return
+        if not text:
+            # None must stay None; '' needs no work either way.
+            return text
 
-        # If there is trailing or leading whitespace, even if it's
-        # just a single space character, we need quoting.
-        needs_quoting = text.strip(WHITESPACE) != text
-
-        # Otherwise, there might be collapsible spaces inside the text.
-        if not needs_quoting:
-            space_count = 0
-            for c in chain(text, [EOF]):
-                if c is not EOF and c in WHITESPACE:
-                    space_count += 1
-                    if space_count >= 2:
-                        needs_quoting = True
-                        break
-                else:
-                    space_count = 0
+        text = text.translate(ESCAPE_TABLE)
 
-        if needs_quoting:
+        # Quoting is needed for leading/trailing whitespace, even if
+        # it's just a single space character, and for collapsible
+        # space runs inside the text. One C-level regex search
+        # instead of a Python-level scan over every character.
+        if NEEDS_QUOTING_RE.search(text):
             return '"%s"' % text
         return text
 
-    def escape(text):
-        """Escape all the characters we know need to be escaped
-        in an Android XML file."""
-        if text is None:
-            return
-        text = text.replace('\\', '\\\\')
-        text = text.replace('\n', '\\n')
-        text = text.replace('\t', '\\t')
-        text = text.replace('\'', '\\\'')
-        text = text.replace('"', '\\"')
-        # Strictly speaking, @ only needs to be escaped when
-        # it's the first character. But, since our target XML
-        # files are basically generate-only and unlikely to be
-        # edited by a user, don't bother with pretty.
-        text = text.replace('@', '\\@')
-        return text
-
     # POSTPROCESS
-    for child_elem in elem.iter():
-        # Strictly speaking, we wouldn't want to touch things
-        # like the root elements tail, but it doesn't matter here,
-        # since they are going to be empty string anyway.
-        child_elem.text = quote(escape(child_elem.text))
-        child_elem.tail = quote(escape(child_elem.tail))
+    if len(elem) == 0:
+        # The common case: no nested markup, so there is exactly one
+        # text node to process and we can skip the iterator entirely
+        # (the element's own tail is empty anyway).
+        elem.text = escape_and_quote(elem.text)
+    else:
+        for child_elem in elem.iter():
+            # Strictly speaking, we wouldn't want to touch things
+            # like the root elements tail, but it doesn't matter here,
+            # since they are going to be empty string anyway.
+            child_elem.text = escape_and_quote(child_elem.text)
+            child_elem.tail = escape_and_quote(child_elem.tail)
 
     return elem
 
@@ -823,21 +950,27 @@ def po2xml(catalog, with_untranslated=False, resfilter=None, warnfunc=dummy_warn
         # Both string and id will contain a tuple of this is a plural
         value = message.string or message.id
 
-        # A colon indicates a string array
-        if ':' in message.context:
+        # A colon indicates a string array. rpartition() doubles as
+        # the test: an empty separator means there was no colon, so
+        # the context isn't scanned twice.
+        name, sep, index = message.context.rpartition(':')
+        if sep:
             # Collect all the strings of this array with their indices,
             # so when we're done processing the whole catalog, we can
-            # sort by index and restore the proper array order.
-            name, index = message.context.split(':', 2)
+            # sort by index and restore the proper array order. The
+            # array is fetched from the tree once rather than per
+            # access below.
             index = int(index)
-            xml_tree.setdefault(name, StringArray())
-            while index >= len(xml_tree[name]):
-                xml_tree[name].append(None)  # fill None for missing indices
-            if xml_tree[name][index] is not None:
+            array = xml_tree.get(name)
+            if array is None:
+                array = xml_tree[name] = StringArray()
+            while index >= len(array):
+                array.append(None)  # fill None for missing indices
+            if array[index] is not None:
                 warnfunc(('Duplicate index %s in array "%s"; ignoring '+
                           'the message. The catalog has possibly been '+
                           'corrupted.') % (index, name), 'error')
-            xml_tree[name][index] = value
+            array[index] = value
 
         # A plurals message
         elif isinstance(message.string, tuple):
@@ -885,8 +1018,10 @@ def write_xml(tree, warnfunc=dummy_warn):
     for name, value in tree.items():
         if isinstance(value, StringArray):
             # string-array - first, sort by index
-            array_el = etree.Element('string-array')
-            array_el.attrib['name'] = name
+            # (Attributes passed at construction time are set in one
+            # C-level call, rather than via a followup assignment
+            # through the attrib proxy.)
+            array_el = etree.Element('string-array', attrib={'name': name})
             for i, v in enumerate(value):
                 item_el = write_to_dom(
                     'item', v, '"%s" index %d' % (name, i), namespaces_used,
@@ -895,8 +1030,7 @@ def write_xml(tree, warnfunc=dummy_warn):
             root_tags.append(array_el)
         elif isinstance(value, Plurals):
             # plurals
-            plural_el = etree.Element('plurals')
-            plural_el.attrib['name'] = name
+            plural_el = etree.Element('plurals', attrib={'name': name})
             for k in sorted(value, key=key_plural_keywords):
                 item_el = write_to_dom(
                     'item', value[k], '"%s" quantity %s' % (name, k),
@@ -912,8 +1046,11 @@ def write_xml(tree, warnfunc=dummy_warn):
             root_tags.append(string_el)
 
     # Generate the root element, define the namespaces that have been
-    # used across all of our child elements.
+    # used across all of our child elements. The root can only be
+    # created now - its nsmap is fixed at construction, and which
+    # namespaces are needed is known only after all children have
+    # been processed - so the children are moved in afterwards, in a
+    # single C-level call.
     root_el = etree.Element('resources', nsmap=namespaces_used)
-    for e in root_tags:
-        root_el.append(e)
+    root_el.extend(root_tags)
     return root_el
@@ -63,34 +63,43 @@ class Language(object):
     """Represents a single language.
     """
 
+    __slots__ = ('code', 'env', 'locale', '_values_dir')
+
     def __init__(self, code, env=None):
         self.code = code
         self.env = env
         self.locale = Locale.parse(code) if code else None
+        if code:
+            # Android uses a special language code format for the
+            # region part. The code never changes, so resolve the
+            # mapping and the resource directory name once here
+            # rather than on every xml() call.
+            code = ANDROID_LOCALE_MAPPING['to'].get(code, code)
+            parts = tuple(code.split('_', 2))
+            if len(parts) == 2:
+                android_code = "%s-r%s" % parts
+            else:
+                android_code = "%s" % parts
+            self._values_dir = 'values-%s' % android_code
+        else:
+            self._values_dir = None
 
     def __unicode__(self):  # pragma: no cover
         return str(self.code)
 
     def xml(self, kind):
-        # Android uses a special language code format for the region part
-        if self.code in ANDROID_LOCALE_MAPPING['to']:
-            code = ANDROID_LOCALE_MAPPING['to'][self.code]
-        else:
-            code = self.code
-        parts = tuple(code.split('_', 2))
-        if len(parts) == 2:
-            android_code = "%s-r%s" % parts
-        else:
-            android_code = "%s" % parts
-        return self.env.path(self.env.resource_dir,
-                             'values-%s/%s.xml' % (android_code, kind))
+        env = self.env
+        return env.path(env.resource_dir,
+                        '%s/%s.xml' % (self._values_dir, kind))
 
     def po(self, kind):
-        filename = self.env.config.layout % {
+        env = self.env
+        config = env.config
+        filename = config.layout % {
             'group': kind,
-            'domain': self.env.config.domain or 'android',
+            'domain': config.domain or 'android',
             'locale': self.code}
-        return self.env.path(self.env.gettext_dir, filename)
+        return env.path(env.gettext_dir, filename)
 
     @property
     def plural_keywords(self):
@@ -107,6 +116,8 @@ class DefaultLanguage(Language):
     directory. For the gettext side, it means the .pot file(s).
     """
 
+    __slots__ = ()
+
     def __init__(self, env):
         super(DefaultLanguage, self).__init__(None, env)
 
@@ -114,14 +125,17 @@ class DefaultLanguage(Language):
         return '<def>'
 
     def xml(self, kind):
-        return self.env.path(self.env.resource_dir, 'values/%s.xml' % kind)
+        env = self.env
+        return env.path(env.resource_dir, 'values/%s.xml' % kind)
 
     def po(self, kind):
-        filename = self.env.config.template_name % {
+        env = self.env
+        config = env.config
+        filename = config.template_name % {
             'group': kind,
-            'domain': self.env.config.domain or 'android',
+            'domain': config.domain or 'android',
         }
-        return self.env.path(self.env.gettext_dir, filename)
+        return env.path(env.gettext_dir, filename)
 
 
 def resolve_locale(code, env):
@@ -153,12 +167,15 @@ def find_project_dir_and_config():
     while True:
         project_dir = config_file = None
 
+        # isfile() already returns False for paths that don't exist,
+        # so a separate exists() check would just double the stat
+        # calls per directory level.
         manifest_path = path.join(cur, 'AndroidManifest.xml')
-        if path.exists(manifest_path) and path.isfile(manifest_path):
+        if path.isfile(manifest_path):
             project_dir = cur
 
         config_path = path.join(cur, '.android2po')
-        if path.exists(config_path) and path.isfile(config_path):
+        if path.isfile(config_path):
             config_file = config_path
 
         # Stop once we found either.
@@ -189,9 +206,12 @@ def find_android_kinds(resource_dir, get_all=False):
     """
     kinds = []
     search_dir = path.join(resource_dir, 'values')
-    for name in os.listdir(search_dir):
-        filename = path.join(search_dir, name)
-        if path.isfile(filename) and name.endswith('.xml'):
+    # scandir() hands us the file type along with each name, so we
+    # don't pay a separate stat() per directory entry.
+    for entry in os.scandir(search_dir):
+        name = entry.name
+        filename = entry.path
+        if name.endswith('.xml') and entry.is_file():
             # We want to support arbitrary xml resource file names, but
             # we also need to make sure we only return those which actually
             # contain string resources. More specifically, a file named
@@ -250,6 +270,8 @@ class Environment(object):
         self.auto_resource_dir = None
         self.resource_dir = None
         self.gettext_dir = None
+        self.cache_dir = None
+        self._initialized = False
 
         # Try to determine if we are inside a project; if so, we a) might
         # find a configuration file, and b) can potentially assume some
@@ -267,11 +289,15 @@ class Environment(object):
         object. We therefore **pull** those values in, and return the
         rest of the options.
         """
-        for name in dir(namespace):
+        # A Namespace keeps its options in __dict__, so vars() gives
+        # us exactly the option values; dir() would walk the whole
+        # class hierarchy just for us to filter most of it out again.
+        # (The list() copy is needed since we delete while iterating.)
+        for name, value in list(vars(namespace).items()):
             if name.startswith('_'):
                 continue
             if name in target.__dict__:
-                setattr(target, name, getattr(namespace, name))
+                setattr(target, name, value)
                 delattr(namespace, name)
         return namespace
 
@@ -336,6 +362,14 @@ class Environment(object):
         and in the process doing some basic validation.
         An ``EnvironmentError`` is thrown if there is something wrong.
         """
+        # Run at most once. Besides saving the directory scans on a
+        # repeated call, this matters for correctness: the steps below
+        # rewrite config values in place (the ignore filters become a
+        # compiled regex, layout/template have their magic values
+        # resolved), so they must not see their own output as input.
+        if self._initialized:
+            return
+
         # If either of those is not specified, we can't continue. Raise a
         # special exception that let's the caller display the proper steps
         # on how to proceed.
@@ -348,15 +382,20 @@ class Environment(object):
         # exist yet, so we create it automatically, but ONLY if it wasn't
         # specified explicitely. If the user gave a specific location,
         # it seems right to let him deal with it fully.
-        if not path.exists(self.gettext_dir) and self.auto_gettext_dir:
+        gettext_dir_exists = path.exists(self.gettext_dir)
+        if not gettext_dir_exists and self.auto_gettext_dir:
             os.makedirs(self.gettext_dir)
-        elif not path.exists(self.gettext_dir):
+        elif not gettext_dir_exists:
             raise EnvironmentError('Gettext directory at "%s" doesn\'t exist.' %
                                    self.gettext_dir)
         elif not path.exists(self.resource_dir):
             raise EnvironmentError('Android resource direcory at "%s" doesn\'t exist.' %
                                    self.resource_dir)
 
+        # Catalogs parsed from the .po files are cached here between
+        # runs; see commands.read_catalog().
+        self.cache_dir = path.join(self.gettext_dir, '.cache')
+
         # Find the Android XML resources that are our original source
         # files, i.e. for example the values/strings.xml file.
         groups_found = find_android_kinds(self.resource_dir,
@@ -377,15 +416,18 @@ class Environment(object):
 
         # If regular expressions are used as ignore filters, precompile
         # those to help speed things along. For simplicity, we also
-        # convert all static ignores to regexes.
-        compiled_list = []
+        # convert all static ignores to regexes. All filters are joined
+        # into one alternation, so testing a resource name is a single
+        # regex match instead of a Python-level loop over every filter;
+        # ``None`` if there are no filters at all.
+        patterns = []
         for ignore_list in self.config.ignores:
             for ignore in ignore_list:
                 if ignore.startswith('/') and ignore.endswith('/'):
-                    compiled_list.append(re.compile(ignore[1:-1]))
+                    patterns.append('(?:%s)' % ignore[1:-1])
                 else:
-                    compiled_list.append(re.compile("^%s$" % re.escape(ignore)))
-        self.config.ignores = compiled_list
+                    patterns.append('(?:^%s$)' % re.escape(ignore))
+        self.config.ignores = re.compile('|'.join(patterns)) if patterns else None
 
         # Validate the layout option, and resolve magic constants ("gnu")
         # to an actual format string.
@@ -454,6 +496,10 @@ class Environment(object):
                                            ", ".join(self.xmlfiles)))
         self.config.template_name = template
 
+        # Only a fully successful run counts; a caller that fixes the
+        # problem behind an exception may try again.
+        self._initialized = True
+
     LANG_DIR = re.compile(r'^values-(\w\w)(?:-r(\w\w))?$')
 
     def get_android_languages(self):
@@ -463,14 +509,19 @@ class Environment(object):
         Return value is a list of ``Language`` instances.
         """
         languages = []
+        match_lang_dir = self.LANG_DIR.match
         for name in os.listdir(self.resource_dir):
-            match = self.LANG_DIR.match(name)
+            # A typical res/ directory is mostly drawable-*/layout-*
+            # etc.; the prefix test discards those without entering
+            # the regex engine at all.
+            if not name.startswith('values-'):
+                continue
+            match = match_lang_dir(name)
             if not match:
                 continue
             country, region = match.groups()
-            pseudo_code = "%s" % country
-            if region:
-                pseudo_code += "_%s" % region
+            pseudo_code = country if not region else \
+                '%s_%s' % (country, region)
             if pseudo_code in ANDROID_LOCALE_MAPPING['from']:
                 code = ANDROID_LOCALE_MAPPING['from'][pseudo_code]
             else:
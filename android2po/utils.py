@@ -3,15 +3,23 @@ from __future__ import unicode_literals
 
 import os, sys, re, uuid, locale
 import codecs
+import threading
 try:
     from hashlib import md5
 except ImportError:  # pragma: no cover
    import md5
+try:
+    # Entirely optional. We only ever hash for change detection,
+    # comparing digests we computed ourselves, so a fast
+    # non-cryptographic hash is preferable where available.
+    from xxhash import xxh64 as make_hasher
+except ImportError:
+    make_hasher = md5
 from os import path
 from termcolor import colored
 import colorama
 
-__all__ = ('Path', 'Writer', 'file_md5', 'format_to_re',)
+__all__ = ('Path', 'Writer', 'file_hash', 'format_to_re',)
 
 
 def format_to_re(format):
@@ -39,15 +47,18 @@ def format_to_re(format):
     return ''.join(parts)
 
 
-def file_md5(filename):
-    """Generate the md5 hash of the given file.
+def file_hash(filename):
+    """Generate a content digest of the given file.
+
+    Only meant for change detection - the algorithm depends on what
+    is installed (xxhash if available, md5 otherwise), so never
+    persist these digests or compare them across machines.
     """
-    h = md5()
+    h = make_hasher()
     f = open(filename, 'rb')
     try:
         while True:
-            # 128 is the md5 digest blocksize
-            data = f.read(128*10)
+            data = f.read(64*1024)
             if not data:
                 break
             h.update(data)
@@ -96,7 +107,7 @@ class Path(str):
         return Path(path.dirname(self), base=self.base)
 
     def hash(self):
-        return file_md5(self)
+        return file_hash(self)
 
 
 class Writer():
@@ -162,12 +173,13 @@ class Writer():
             assert event in Writer.EVENTS, 'Not a valid event type'
             self['event'] = event
             self.update(*more, **data)
-            self.writer._print_action(self)
-            if self in self.writer._pending_actions:
-                self.writer._pending_actions.remove(self)
-            self.is_done = True
-            if self.severity == 'error':
-                self.writer.erroneous = True
+            with self.writer.lock:
+                self.writer._print_action(self)
+                if self in self.writer._pending_actions:
+                    self.writer._pending_actions.remove(self)
+                self.is_done = True
+                if self.severity == 'error':
+                    self.writer.erroneous = True
 
         def update(self, text=None, severity=None, **more_data):
             """Update the message with the given data.
@@ -192,13 +204,14 @@ class Writer():
             is_allowed = self.writer.allowed(severity)
             if severity == 'error':
                 self.writer.erroneous = True
-            if not self.is_done:
-                if is_allowed:
-                    self.messages.append((message, severity))
-            elif is_allowed:
-                if self.awaiting_promotion:
-                    self.writer._print_action(self, force=True)
-                self.writer._print_message(message, severity)
+            with self.writer.lock:
+                if not self.is_done:
+                    if is_allowed:
+                        self.messages.append((message, severity))
+                elif is_allowed:
+                    if self.awaiting_promotion:
+                        self.writer._print_action(self, force=True)
+                    self.writer._print_message(message, severity)
 
         @property
         def event(self):
@@ -217,6 +230,11 @@ class Writer():
         self._pending_actions = []
         self.verbosity = verbosity
         self.erroneous = False
+        # Guards the action bookkeeping and the actual printing, so
+        # commands may complete actions from multiple worker threads
+        # without garbling the output. Reentrant because done() prints
+        # while already holding it.
+        self.lock = threading.RLock()
 
         # sys.stdout is in text mode by default in Python 3.
         # Create a codec writer wrapping stdout only for Python 2.
@@ -243,7 +261,8 @@ class Writer():
         be printed together with the action once it is "done".
         """
         action = Writer.Action(self, *a, **kw)
-        self._pending_actions.append(action)
+        with self.lock:
+            self._pending_actions.append(action)
         return action
 
     def message(self, *a, **kw):
@@ -260,10 +279,12 @@ class Writer():
 
         Not the sibling of begin()!
         """
-        for action in self._pending_actions:
-            if not action.is_done:
-                action.done('failed')
-        self._pending_actions = []
+        with self.lock:
+            # Iterate a copy; done() removes the action from the list.
+            for action in list(self._pending_actions):
+                if not action.is_done:
+                    action.done('failed')
+            self._pending_actions = []
 
     def allowed(self, severity):
         """Return ``True`` if mesages with this severity pass
@@ -325,13 +346,14 @@ class Writer():
         tag = "[%s]" % action['event']
 
         style = self.get_style_for_action(action)
-        self.stdout.write(colored("%*s" % (self.max_event_len, tag), attrs=['bold',], **style))
-        self.stdout.write(" ")
-        self.stdout.write(colored(text, **style))
-        self.stdout.write("\n")
+        # Assemble the full line first; every write() potentially hits
+        # the terminal (or pipe) as its own syscall, and with hundreds
+        # of actions those add up.
+        self.stdout.write("%s %s\n" % (
+            colored("%*s" % (self.max_event_len, tag), attrs=['bold',], **style),
+            colored(text, **style)))
 
     def _print_message(self, message, severity):
         style = self._get_style_for_level(severity)
         self.stdout.write(colored(" "*(self.max_event_len+1) + "- %s" % message,
-                          **style))
-        self.stdout.write("\n")
+                          **style) + "\n")
@@ -31,6 +31,21 @@ def test_read_template():
     assert [m.context for m in catalog if m.id] == ['colors:0', 'colors:1']
 
 
+def test_read_comment_inside_item():
+    """A comment nested inside an array item must not end up in the
+    message (it used to be rendered like a tag).
+    """
+    catalog = xmlstr2po('''
+        <resources>
+            <string-array name="colors">
+                <item>red<!-- like blood --></item>
+                <item>green</item>
+            </string-array>
+        </resources>
+    ''')
+    assert [m.id for m in catalog if m.id] == ['red', 'green']
+
+
 def test_read_order():
     """Test that a strings of a string-array have the same position
     in the final catalog as the string-array had in the xml file, e.g.
@@ -93,6 +93,16 @@ class TestFromXML():
         # Multiple levels of nesting.
         self.assert_convert('<b><u>hello</u> world</b>')
 
+    def test_comments_inside_string(self):
+        """XML comments and processing instructions nested inside a
+        string are not part of the message; they are skipped, and
+        their tail text is dropped with them.
+        """
+        self.assert_convert('a<!-- comment -->b', 'a')
+        self.assert_convert('a<?pi data?>b', 'a')
+        self.assert_convert('a<b>bold</b><!-- comment -->tail',
+                            'a<b>bold</b>')
+
     def test_tags_and_attributes(self):
         """Test certain XML-inherited syntax elements, in particular,
         that attributes of nested tags are rendered properly.
@@ -9,8 +9,11 @@ will thus ensure that commands run, but does not check that they do the
 right thing.
 """
 
+import os
+
 from nose.tools import assert_raises
 from babel.messages import Catalog
+from android2po.commands import read_catalog
 from android2po.convert import StringArray
 from .helpers import ProgramTest
 
@@ -39,6 +42,41 @@ class TestExport(ProgramTest):
         p.write_xml(data="""<resources></resources>""", lang='de')
         assert '[skipped]' in p.program('export', {'de': ''})
 
+    def test_export_skips_unchanged_files(self):
+        """If nothing changed since the last run, an export must not
+        rewrite the .po file: it reports the file as unchanged and
+        leaves its mtime alone.
+        """
+        p = self.setup_project(xml_langs=['de'])
+        p.write_xml(data={'s1': 'foo'})
+        p.program('init')
+        p.program('export')
+        po_file = p.p('locale', 'de.po')
+        old_mtime = os.stat(po_file).st_mtime_ns
+        assert '[unchanged]' in p.program('export')
+        assert os.stat(po_file).st_mtime_ns == old_mtime
+
+
+class TestCatalogCache(ProgramTest):
+    """The parsed-catalog disk cache used by read_catalog().
+    """
+
+    def test_cache_hit_returns_equivalent_catalog(self):
+        p = self.setup_project()
+        c = Catalog(locale='de')
+        c.add('foo', 'bar', context='foo')
+        p.write_po(c, 'de.po')
+
+        filename = p.p('locale', 'de.po')
+        cache_dir = p.p('locale', '.cache')
+        parsed = read_catalog(filename, cache_dir=cache_dir)
+        # The second read is served from the cache written above, and
+        # must yield the same messages as the parse did.
+        assert os.listdir(cache_dir)
+        cached = read_catalog(filename, cache_dir=cache_dir)
+        assert [(m.id, m.string, m.context) for m in cached] == \
+               [(m.id, m.string, m.context) for m in parsed]
+
 
 class TestImport(ProgramTest):
 